@@ -4,8 +4,6 @@ from pathlib import Path
 from typing import Dict, List, Optional
 from dftio import __version__
 from dftio.io.parse import ParserRegister
-from tqdm import tqdm
-from multiprocessing.pool import Pool
 from dftio.logger import set_log_handles
 from dftio.plot.plot_eigs import BandPlot
 
@@ -117,7 +115,7 @@ def main_parser() -> argparse.ArgumentParser:
         "--format",
         type=str,
         default="dat",
-        help="The output file format, should be dat, ase or lmdb.",
+        help="The output file format, should be dat, npy, ase, hdf5 or lmdb.",
     )
 
     parser_parse.add_argument(
@@ -172,7 +170,7 @@ def main_parser() -> argparse.ArgumentParser:
         "--format",
         type=str,
         default=None,
-        help="load file format, should be dat or ase. default is None, which means auto detect.",
+        help="load file format, should be dat, npy or ase. default is None, which means auto detect.",
     )
     
     parser_band.add_argument(
@@ -215,18 +213,6 @@ def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
 
     return parsed_args
 
-class wapper:
-    def __init__(self, args):
-        self.args = args
-        self.parser = ParserRegister(
-            **self.args
-        )
-        
-    def __call__(self, idx):
-        # print(idx)
-        self.parser.write(idx=idx, **self.args)
-        return True
-
 def main():
     args = parse_args()
 
@@ -240,15 +226,7 @@ def main():
                         **dict_args
                     )
         
-        if args.num_workers > 1:
-            with Pool(args.num_workers) as p:
-                list(tqdm(p.imap(wapper(dict_args), range(len(parser))), total=len(parser), desc="Parsing the DFT files: "))
-        else:
-            parser = ParserRegister(
-                **dict_args
-            )
-            for i in tqdm(range(len(parser)), desc="Parsing the DFT files: "):
-                parser.write(idx=i, **dict_args)
+        parser.write_many(range(len(parser)), **dict_args)
         
     if args.command == "band":
         bandplot = BandPlot(
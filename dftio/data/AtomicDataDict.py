@@ -29,6 +29,67 @@ def validate_keys(keys, graph_required=True):
         raise ValueError("If `edge_cell_shift` given, `cell` must be given.")
 
 
+def _vec_lengths(vec):
+    """Lengths of a [n, 3] array of vectors, cheaper than np.linalg.norm for real input."""
+    return np.sqrt(np.einsum("ij,ij->i", vec, vec))
+
+
+def _apply_shifts(cell_shift, cell, batch_per_edge):
+    """Compute ``cell_shift[n] @ cell[batch_per_edge[n]]`` for every edge.
+
+    Edges are grouped by frame so that each frame issues a single GEMM,
+    instead of gathering an [n_edge, 3, 3] cell tensor and contracting it.
+    """
+    counts = np.bincount(batch_per_edge, minlength=cell.shape[0])
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    out = np.empty((len(cell_shift), 3), dtype=np.result_type(cell_shift, cell))
+    if np.all(batch_per_edge[1:] >= batch_per_edge[:-1]):
+        # edges of a batch are usually already ordered by frame, so each group is a contiguous slice
+        for b, (lo, hi) in enumerate(zip(offsets[:-1], offsets[1:])):
+            np.matmul(cell_shift[lo:hi], cell[b], out=out[lo:hi])
+        return out
+
+    order = np.argsort(batch_per_edge, kind="stable")
+    for b, (lo, hi) in enumerate(zip(offsets[:-1], offsets[1:])):
+        idx = order[lo:hi]
+        out[idx] = cell_shift[idx] @ cell[b]
+    return out
+
+
+def _displacements(data: Type, index: np.ndarray, cell_shift_key: str) -> np.ndarray:
+    """Compute ``pos[index[1]] - pos[index[0]] + cell_shift @ cell`` for every pair in ``index``.
+
+    The periodic image offsets are skipped when there is no cell or the cell is all zero,
+    which is always the case for molecular (non-PBC) data.
+    """
+    pos = data[_keys.POSITIONS_KEY]
+    # subtract in place to save one [n_edges, 3] temporary
+    vec = np.take(pos, index[1], axis=0)
+    vec -= np.take(pos, index[0], axis=0)
+
+    if not (_keys.CELL_KEY in data and data[_keys.CELL_KEY].any()):
+        # ^ note that to save time we don't check that the cell shifts are trivial if no cell is provided; we just assume they are either not present or all zero.
+        return vec
+
+    # -1 gives a batch dim no matter what
+    cell = data[_keys.CELL_KEY].reshape(-1, 3, 3)
+    cell_shift = data[cell_shift_key]
+    if cell.shape[0] > 1:
+        batch = data[_keys.BATCH_KEY]
+        # Cell has a batch dimension
+        # note the ASE cell vectors as rows convention
+        return vec + _apply_shifts(cell_shift, cell, batch[index[0]])
+    else:
+        # Cell has either no batch dimension, or a useless one,
+        # so we can avoid creating the large intermediate cell tensor.
+        # Note that we do NOT check that the batch array, if it is present,
+        # is trivial — but this does need to be consistent.
+        return vec + np.matmul(
+            cell_shift,
+            cell.squeeze(0),  # remove batch dimension
+        )
+
+
 def with_edge_vectors(data: Type, with_lengths: bool = True) -> Type:
     """Compute the edge displacement vectors for a graph.
 
@@ -40,9 +101,7 @@ def with_edge_vectors(data: Type, with_lengths: bool = True) -> Type:
     """
     if _keys.EDGE_VECTORS_KEY in data:
         if with_lengths and _keys.EDGE_LENGTH_KEY not in data:
-            data[_keys.EDGE_LENGTH_KEY] = np.linalg.norm(
-                data[_keys.EDGE_VECTORS_KEY], axis=-1
-            )
+            data[_keys.EDGE_LENGTH_KEY] = _vec_lengths(data[_keys.EDGE_VECTORS_KEY])
 
         return data
     else:
@@ -51,37 +110,12 @@ def with_edge_vectors(data: Type, with_lengths: bool = True) -> Type:
         # (1) backwardable, because everything (pos, cell, shifts)
         #     is Tensors.
         # (2) works on a Batch constructed from AtomicData
-        pos = data[_keys.POSITIONS_KEY]
         edge_index = data[_keys.EDGE_INDEX_KEY]
-        edge_vec = pos[edge_index[1]] - pos[edge_index[0]]
-        if _keys.CELL_KEY in data and np.sum(np.abs(data[_keys.CELL_KEY])) > 1e-10:
-            # ^ note that to save time we don't check that the edge_cell_shifts are trivial if no cell is provided; we just assume they are either not present or all zero.
-            # -1 gives a batch dim no matter what
-            cell = data[_keys.CELL_KEY].reshape(-1, 3, 3)
-            edge_cell_shift = data[_keys.EDGE_CELL_SHIFT_KEY]
-            if cell.shape[0] > 1:
-                batch = data[_keys.BATCH_KEY]
-                # Cell has a batch dimension
-                # note the ASE cell vectors as rows convention
-                edge_vec = edge_vec + np.einsum(
-                    "ni,nij->nj", edge_cell_shift, cell[batch[edge_index[0]]]
-                )
-                # TODO: is there a more efficient way to do the above without
-                # creating an [n_edge] and [n_edge, 3, 3] tensor?
-            else:
-                # Cell has either no batch dimension, or a useless one,
-                # so we can avoid creating the large intermediate cell tensor.
-                # Note that we do NOT check that the batch array, if it is present,
-                # is trivial — but this does need to be consistent.
-                edge_vec = edge_vec + np.einsum(
-                    "ni,ij->nj",
-                    edge_cell_shift,
-                    cell.squeeze(0),  # remove batch dimension
-                )
+        edge_vec = _displacements(data, edge_index, _keys.EDGE_CELL_SHIFT_KEY)
 
         data[_keys.EDGE_VECTORS_KEY] = edge_vec
         if with_lengths:
-            data[_keys.EDGE_LENGTH_KEY] = np.linalg.norm(edge_vec, axis=-1)
+            data[_keys.EDGE_LENGTH_KEY] = _vec_lengths(edge_vec)
         return data
 
 def with_env_vectors(data: Type, with_lengths: bool = True) -> Type:
@@ -95,9 +129,7 @@ def with_env_vectors(data: Type, with_lengths: bool = True) -> Type:
     """
     if _keys.ENV_VECTORS_KEY in data:
         if with_lengths and _keys.ENV_LENGTH_KEY not in data:
-            data[_keys.ENV_LENGTH_KEY] = np.linalg.norm(
-                data[_keys.ENV_VECTORS_KEY], axis=-1
-            )
+            data[_keys.ENV_LENGTH_KEY] = _vec_lengths(data[_keys.ENV_VECTORS_KEY])
         return data
     else:
         # Build it dynamically
@@ -105,36 +137,11 @@ def with_env_vectors(data: Type, with_lengths: bool = True) -> Type:
         # (1) backwardable, because everything (pos, cell, shifts)
         #     is Tensors.
         # (2) works on a Batch constructed from AtomicData
-        pos = data[_keys.POSITIONS_KEY]
         env_index = data[_keys.ENV_INDEX_KEY]
-        env_vec = pos[env_index[1]] - pos[env_index[0]]
-        if _keys.CELL_KEY in data and np.sum(np.abs(data[_keys.CELL_KEY])) > 1e-10:
-            # ^ note that to save time we don't check that the edge_cell_shifts are trivial if no cell is provided; we just assume they are either not present or all zero.
-            # -1 gives a batch dim no matter what
-            cell = data[_keys.CELL_KEY].reshape(-1, 3, 3)
-            env_cell_shift = data[_keys.ENV_CELL_SHIFT_KEY]
-            if cell.shape[0] > 1:
-                batch = data[_keys.BATCH_KEY]
-                # Cell has a batch dimension
-                # note the ASE cell vectors as rows convention
-                env_vec = env_vec + np.einsum(
-                    "ni,nij->nj", env_cell_shift, cell[batch[env_index[0]]]
-                )
-                # TODO: is there a more efficient way to do the above without
-                # creating an [n_edge] and [n_edge, 3, 3] tensor?
-            else:
-                # Cell has either no batch dimension, or a useless one,
-                # so we can avoid creating the large intermediate cell tensor.
-                # Note that we do NOT check that the batch array, if it is present,
-                # is trivial — but this does need to be consistent.
-                env_vec = env_vec + np.einsum(
-                    "ni,ij->nj",
-                    env_cell_shift,
-                    cell.squeeze(0),  # remove batch dimension
-                )
+        env_vec = _displacements(data, env_index, _keys.ENV_CELL_SHIFT_KEY)
         data[_keys.ENV_VECTORS_KEY] = env_vec
         if with_lengths:
-            data[_keys.ENV_LENGTH_KEY] = np.linalg.norm(env_vec, dim=-1)
+            data[_keys.ENV_LENGTH_KEY] = _vec_lengths(env_vec)
         return data
     
 def with_onsitenv_vectors(data: Type, with_lengths: bool = True) -> Type:
@@ -148,9 +155,7 @@ def with_onsitenv_vectors(data: Type, with_lengths: bool = True) -> Type:
     """
     if _keys.ONSITENV_VECTORS_KEY in data:
         if with_lengths and _keys.ONSITENV_LENGTH_KEY not in data:
-            data[_keys.ONSITENV_LENGTH_KEY] = np.linalg.norm(
-                data[_keys.ONSITENV_VECTORS_KEY], axis=-1
-            )
+            data[_keys.ONSITENV_LENGTH_KEY] = _vec_lengths(data[_keys.ONSITENV_VECTORS_KEY])
         return data
     else:
         # Build it dynamically
@@ -158,36 +163,11 @@ def with_onsitenv_vectors(data: Type, with_lengths: bool = True) -> Type:
         # (1) backwardable, because everything (pos, cell, shifts)
         #     is Tensors.
         # (2) works on a Batch constructed from AtomicData
-        pos = data[_keys.POSITIONS_KEY]
         env_index = data[_keys.ONSITENV_INDEX_KEY]
-        env_vec = pos[env_index[1]] - pos[env_index[0]]
-        if _keys.CELL_KEY in data and np.sum(np.abs(data[_keys.CELL_KEY])) > 1e-10:
-            # ^ note that to save time we don't check that the edge_cell_shifts are trivial if no cell is provided; we just assume they are either not present or all zero.
-            # -1 gives a batch dim no matter what
-            cell = data[_keys.CELL_KEY].reshape(-1, 3, 3)
-            env_cell_shift = data[_keys.ONSITENV_CELL_SHIFT_KEY]
-            if cell.shape[0] > 1:
-                batch = data[_keys.BATCH_KEY]
-                # Cell has a batch dimension
-                # note the ASE cell vectors as rows convention
-                env_vec = env_vec + np.einsum(
-                    "ni,nij->nj", env_cell_shift, cell[batch[env_index[0]]]
-                )
-                # TODO: is there a more efficient way to do the above without
-                # creating an [n_edge] and [n_edge, 3, 3] tensor?
-            else:
-                # Cell has either no batch dimension, or a useless one,
-                # so we can avoid creating the large intermediate cell tensor.
-                # Note that we do NOT check that the batch array, if it is present,
-                # is trivial — but this does need to be consistent.
-                env_vec = env_vec + np.einsum(
-                    "ni,ij->nj",
-                    env_cell_shift,
-                    cell.squeeze(0),  # remove batch dimension
-                )
+        env_vec = _displacements(data, env_index, _keys.ONSITENV_CELL_SHIFT_KEY)
         data[_keys.ONSITENV_VECTORS_KEY] = env_vec
         if with_lengths:
-            data[_keys.ONSITENV_LENGTH_KEY] = np.linalg.norm(env_vec, dim=-1)
+            data[_keys.ONSITENV_LENGTH_KEY] = _vec_lengths(env_vec)
         return data
 
 
@@ -203,12 +183,6 @@ def with_batch(data: Type) -> Type:
         pos = data[_keys.POSITIONS_KEY]
         batch = np.zeros(len(pos), dtype=np.int64)
         data[_keys.BATCH_KEY] = batch
-        # ugly way to make a tensor of [0, len(pos)], but it avoids transfers or casts
-        data[_keys.BATCH_PTR_KEY] = np.arange(
-            start=0,
-            stop=len(pos) + 1,
-            step=len(pos),
-            dtype=np.int64
-        )
+        data[_keys.BATCH_PTR_KEY] = np.array([0, len(pos)], dtype=np.int64)
         
         return data
@@ -1,5 +1,8 @@
 import os
 import glob
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from abc import ABC, abstractmethod
 import numpy as np
@@ -11,7 +14,9 @@ import lmdb
 from dftio.data import _keys
 from dftio.utils import j_must_have
 from dftio.register import Register
+from ase.data import chemical_symbols
 from ase.io.trajectory import Trajectory
+from tqdm import tqdm
 
 
 def find_target_line(f, target):
@@ -23,6 +28,81 @@ def find_target_line(f, target):
     return None
 
 
+def _to_f32c(a, target_shape):
+    # C-contiguous float32 copy in the target shape, without copying again if a already is one
+    return np.ascontiguousarray(a, dtype=np.float32).reshape(target_shape)
+
+
+# blocks of one frame as flat arrays: keys (n_block, 5) holds i, j, Rx, Ry, Rz, block n spans
+# data[offsets[n]:offsets[n+1]] and has shape shapes[n]
+BlockArray = namedtuple("BlockArray", ["keys", "shapes", "offsets", "data"])
+
+
+def _split_key(keys):
+    # "i_j_Rx_Ry_Rz" strings -> (n, 5) int array
+    return np.fromiter((int(x) for k in keys for x in k.split("_")), dtype=np.int32, count=5*len(keys)).reshape(-1, 5)
+
+
+def _blocks_to_array(blocks):
+    # dict of blocks keyed by i_j_Rx_Ry_Rz -> BlockArray
+    values = list(blocks.values())
+    shapes = np.array([v.shape for v in values], dtype=np.int64).reshape(-1, 2)
+    offsets = np.concatenate(([0], np.cumsum(shapes.prod(axis=1))))
+    if values:
+        data = np.concatenate([v.ravel() for v in values])
+    else:
+        data = np.empty(0, dtype=np.float32)
+    return BlockArray(keys=_split_key(list(blocks.keys())), shapes=shapes, offsets=offsets, data=data)
+
+
+def _array_to_blocks(block_array):
+    # BlockArray -> dict of blocks keyed by i_j_Rx_Ry_Rz
+    keys, shapes, offsets, data = block_array
+    return {
+        "_".join(str(x) for x in key): data[offsets[n]:offsets[n+1]].reshape(shapes[n])
+        for n, key in enumerate(keys.tolist())
+    }
+
+
+def write_blocks_hdf5(group, blocks):
+    """Write the blocks of one frame, a dict keyed by i_j_Rx_Ry_Rz, into an h5py group as a ``BlockArray``.
+
+    The group holds the four datasets keys, shapes, offsets and data, so the number
+    of datasets does not grow with the number of blocks.
+    """
+    block_array = _blocks_to_array(blocks)
+    group.create_dataset("keys", data=block_array.keys)
+    group.create_dataset("shapes", data=block_array.shapes)
+    group.create_dataset("offsets", data=block_array.offsets)
+    if block_array.data.size > 0:
+        group.create_dataset("data", data=block_array.data, chunks=True, compression="lzf")
+    else:
+        group.create_dataset("data", data=block_array.data)
+
+
+def read_blocks_hdf5(group):
+    """Read the blocks written by ``write_blocks_hdf5`` back into a dict keyed by i_j_Rx_Ry_Rz."""
+    return _array_to_blocks(BlockArray(
+        keys=group["keys"][()],
+        shapes=group["shapes"][()],
+        offsets=group["offsets"][()],
+        data=group["data"][()]
+    ))
+
+
+# parser held by each write_many worker process, set once by the pool initializer
+_worker_parser = None
+
+
+def _init_write_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+
+def _write_worker(idx, kwargs):
+    return _worker_parser.write(idx=idx, **kwargs)
+
+
 class ParserRegister:
     _register = Register()
 
@@ -61,6 +141,16 @@ class Parser(ABC):
         else:
             self.raw_datas = glob.glob(root + '/*' + prefix + '*')
     
+    @property
+    def raw_datas(self):
+        return self._raw_datas
+
+    @raw_datas.setter
+    def raw_datas(self, raw_datas):
+        # formulas are cached by idx, reassigning raw_datas remaps idx, so drop them
+        self._raw_datas = raw_datas
+        self._formula_cache = {}
+
     def __len__(self):
         return len(self.raw_datas)
     
@@ -78,11 +168,20 @@ class Parser(ABC):
     #     param_hash = hashlib.sha1(buffer).hexdigest()
     #     return param_hash
     
-    def formula(self, idx):
-        structure = self.get_structure(idx)
+    def formula(self, idx, structure=None):
+        if structure is None:
+            if idx in self._formula_cache:
+                return self._formula_cache[idx]
+            structure = self.get_structure(idx)
         atomic_number = j_must_have(structure, _keys.ATOMIC_NUMBERS_KEY)
 
-        return ase.Atoms(numbers=atomic_number).get_chemical_formula()
+        # same as ase.Atoms(numbers=atomic_number).get_chemical_formula(): C and H first, then alphabetical
+        count = Counter(chemical_symbols[z] for z in atomic_number.tolist())
+        symbols = sorted(count, key=lambda s: ({"C": 0, "H": 1}.get(s, 2), s))
+        formula = "".join(s + (str(count[s]) if count[s] > 1 else "") for s in symbols)
+
+        self._formula_cache[idx] = formula
+        return formula
 
     def structure_to_ase(self, structure):
         self.check_structure(idx=None, structure=structure)
@@ -100,30 +199,32 @@ class Parser(ABC):
     
     def ase_to_structure(self, sys):
         if isinstance(sys, list):
-            pos = []
-            cell = []
+            assert isinstance(sys[0], ase.Atoms), "The input system is not a list of ase.Atoms object!"
             pbc = sys[0].pbc
             atom_numbs = sys[0].get_atomic_numbers()
-            for s in sys:
+            # fill preallocated float32 buffers in place instead of stacking a list of float64 copies
+            pos = np.empty((len(sys), len(atom_numbs), 3), dtype=np.float32)
+            cell = np.empty((len(sys), 3, 3), dtype=np.float32)
+            for i, s in enumerate(sys):
                 assert isinstance(s, ase.Atoms), "The input system is not a list of ase.Atoms object!"
-                pos.append(s.positions)
-                cell.append(s.cell)
-                assert np.all(s.pbc == pbc), "The input system is not a list of ase.Atoms object with same PBC!"
-                assert np.all(s.get_atomic_numbers() == atom_numbs), "The input system is not a list of ase.Atoms object with same atomic numbers!"
+                assert np.array_equal(s.pbc, pbc), "The input system is not a list of ase.Atoms object with same PBC!"
+                assert np.array_equal(s.numbers, atom_numbs), "The input system is not a list of ase.Atoms object with same atomic numbers!"
+                pos[i] = s.positions
+                cell[i] = s.cell.array
             
             structure = {
                 _keys.ATOMIC_NUMBERS_KEY: atom_numbs.astype(np.int32),
                 _keys.PBC_KEY: pbc,
-                _keys.POSITIONS_KEY: np.array(pos).astype(np.float32),
-                _keys.CELL_KEY: np.array(cell).astype(np.float32)
+                _keys.POSITIONS_KEY: pos,
+                _keys.CELL_KEY: cell
             }
 
         elif isinstance(sys, ase.Atoms):
             structure = {
             _keys.ATOMIC_NUMBERS_KEY: sys.get_atomic_numbers().astype(np.int32),
             _keys.PBC_KEY: sys.pbc,
-            _keys.POSITIONS_KEY: sys.positions[np.newaxis,:,:].astype(np.float32),
-            _keys.CELL_KEY: sys.cell[np.newaxis,:,:].astype(np.float32)
+            _keys.POSITIONS_KEY: _to_f32c(sys.positions, (1, -1, 3)),
+            _keys.CELL_KEY: _to_f32c(sys.cell.array, (1, 3, 3))
             }
         else:
             raise ValueError("The input system is not a list or ase.Atoms object!")
@@ -138,7 +239,7 @@ class Parser(ABC):
 
     @abstractmethod
     def get_blocks(self, idx, hamiltonian: bool=False, overlap: bool=False, density_matrix: bool=False):
-        pass # return a list of hamiltonian, overlap, density_matrix dict, with i_j_Rx_Ry_Rz as key, and the block as value
+        pass # return a list of hamiltonian, overlap, density_matrix dict, with i_j_Rx_Ry_Rz as key, and the block as value.
 
     # @abstractmethod
     # def get_field():
@@ -207,15 +308,73 @@ class Parser(ABC):
     def write(self, idx, outroot, format, eigenvalue, hamiltonian, overlap, density_matrix, band_index_min, **kwargs):
         if format == "hdf5":
             self.write_hdf5(idx=idx, outroot=outroot, eigenvalue=eigenvalue, hamiltonian=hamiltonian, overlap=overlap, density_matrix=density_matrix,band_index_min=band_index_min)
-        elif format in ["dat", "ase"]:
+        elif format in ["dat", "npy", "ase"]:
             self.write_dat(idx=idx, outroot=outroot, fmt=format, eigenvalue=eigenvalue, hamiltonian=hamiltonian, overlap=overlap, density_matrix=density_matrix,band_index_min=band_index_min)
         elif format == "lmdb":
             self.write_lmdb(idx=idx, outroot=outroot, eigenvalue=eigenvalue, hamiltonian=hamiltonian, overlap=overlap, density_matrix=density_matrix,band_index_min=band_index_min)
         else:
             raise NotImplementedError(f"Format: {format} is not implemented!")
         
+    def write_many(self, idxs, outroot, format, eigenvalue, hamiltonian, overlap, density_matrix, band_index_min, num_workers=None, **kwargs):
+        """Write several idx in parallel, one process per worker, see ``write`` for the other parameters.
+
+        The parser is pickled once to each worker, so its attributes (e.g. raw_sys) must be picklable.
+        Each idx is written independently: dat/ase/hdf5 use one folder or file per idx and lmdb uses
+        one database per worker process.
+
+        Parameters
+        ----------
+        idxs : list of int
+            The indices of the DFT calculations to write.
+        num_workers : int, optional
+            The number of worker processes, default is os.cpu_count().
+        """
+        idxs = list(idxs)
+        write_kwargs = dict(outroot=outroot, format=format, eigenvalue=eigenvalue, hamiltonian=hamiltonian,
+                            overlap=overlap, density_matrix=density_matrix, band_index_min=band_index_min, **kwargs)
+        if num_workers is None:
+            num_workers = os.cpu_count()
+
+        if num_workers <= 1:
+            for idx in tqdm(idxs, desc="Parsing the DFT files: "):
+                self.write(idx=idx, **write_kwargs)
+            return True
+
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_write_worker, initargs=(self,)) as executor:
+            list(tqdm(executor.map(_write_worker, idxs, repeat(write_kwargs)), total=len(idxs), desc="Parsing the DFT files: "))
+
+        return True
+
     def write_hdf5(self, idx, outroot, eigenvalue: bool=False, hamiltonian: bool=False, overlap: bool=False, density_matrix: bool=False, band_index_min=0):
-        pass
+        # write everything of one idx into a single file, blocks are stored as BlockArray (see write_blocks_hdf5)
+        os.makedirs(outroot, exist_ok=True)
+        structure = self.get_structure(idx)
+
+        with h5py.File(os.path.join(outroot, self.formula(idx=idx, structure=structure)+".{}.h5".format(idx)), 'w') as fid:
+            struct_group = fid.create_group("structure")
+            struct_group.create_dataset("cell", data=structure[_keys.CELL_KEY])
+            struct_group.create_dataset("positions", data=structure[_keys.POSITIONS_KEY])
+            struct_group.create_dataset("atomic_numbers", data=structure[_keys.ATOMIC_NUMBERS_KEY])
+            struct_group.create_dataset("pbc", data=structure[_keys.PBC_KEY])
+
+            if eigenvalue:
+                eigstatus = self.get_eigenvalue(idx=idx, band_index_min=band_index_min)
+                self.check_eigenvalue(idx=idx, eigstatus=eigstatus)
+                fid.create_dataset("kpoints", data=eigstatus[_keys.KPOINT_KEY])
+                fid.create_dataset("eigenvalues", data=eigstatus[_keys.ENERGY_EIGENVALUE_KEY])
+
+            if any([hamiltonian, overlap, density_matrix]):
+                fid.attrs["basis"] = str(self.get_basis(idx))
+                ham, ovp, dm = self.get_blocks(idx, hamiltonian, overlap, density_matrix)
+                for name, flag, blocks in zip(["hamiltonians", "overlaps", "density_matrices"], [hamiltonian, overlap, density_matrix], [ham, ovp, dm]):
+                    if not flag:
+                        continue
+                    group = fid.create_group(name)
+                    for i in range(len(blocks)):
+                        write_blocks_hdf5(group.create_group(str(i)), blocks[i])
+                del ham, ovp, dm
+
+        return True
     
     def write_struct(self, structure, out_dir, fmt='dat'):
         # write structure
@@ -225,6 +384,13 @@ class Parser(ABC):
             np.savetxt(os.path.join(out_dir, "positions.dat"), structure[_keys.POSITIONS_KEY].reshape(-1, 3))
             np.savetxt(os.path.join(out_dir, "atomic_numbers.dat"), structure[_keys.ATOMIC_NUMBERS_KEY], fmt='%d')
             np.savetxt(os.path.join(out_dir, "pbc.dat"), structure[_keys.PBC_KEY])
+
+        elif fmt == 'npy':
+            # binary counterpart of 'dat', keeps the (n_frame, ...) shapes and dtypes
+            np.save(os.path.join(out_dir, "cell.npy"), structure[_keys.CELL_KEY])
+            np.save(os.path.join(out_dir, "positions.npy"), structure[_keys.POSITIONS_KEY])
+            np.save(os.path.join(out_dir, "atomic_numbers.npy"), structure[_keys.ATOMIC_NUMBERS_KEY])
+            np.save(os.path.join(out_dir, "pbc.npy"), structure[_keys.PBC_KEY])
         
         elif fmt=='ase':
             ase_list = self.structure_to_ase(structure)
@@ -241,7 +407,7 @@ class Parser(ABC):
        
         structure = self.get_structure(idx)
 
-        out_dir = os.path.join(outroot, self.formula(idx=idx)+".{}".format(idx))
+        out_dir = os.path.join(outroot, self.formula(idx=idx, structure=structure)+".{}".format(idx))
         os.makedirs(out_dir, exist_ok=True)
         # The abacus must have PBC, so here we save cell by default
         # np.savetxt(os.path.join(out_dir, "cell.dat"), structure[_keys.CELL_KEY].reshape(-1, 3))
@@ -303,32 +469,33 @@ class Parser(ABC):
 
         n_frames = structure[_keys.POSITIONS_KEY].shape[0]
         lmdb_env = lmdb.open(out_dir, map_size=1048576000000, lock=True)
-        for nf in range(n_frames):
-            data_dict = {}
-            data_dict[_keys.ATOMIC_NUMBERS_KEY] = structure[_keys.ATOMIC_NUMBERS_KEY]
-            data_dict[_keys.CELL_KEY] = structure[_keys.CELL_KEY][nf]
-            data_dict[_keys.POSITIONS_KEY] = structure[_keys.POSITIONS_KEY][nf]
-            data_dict[_keys.PBC_KEY] = structure[_keys.PBC_KEY]
-
-            if eigenvalue:
-                data_dict[_keys.ENERGY_EIGENVALUE_KEY] = eigstatus[_keys.ENERGY_EIGENVALUE_KEY][nf]
-                data_dict[_keys.KPOINT_KEY] = eigstatus[_keys.KPOINT_KEY]
-
-            if hamiltonian:
-                data_dict["hamiltonian"] = ham[nf]
-            if overlap:
-                data_dict["overlap"] = ovp[nf]
-            if density_matrix:
-                data_dict["density_matrix"] = dm[nf]
-
-            data_dict["idx"] = idx
-            data_dict["nf"] = nf
-
-            data_dict = pickle.dumps(data_dict)
-
-            # write
-            with lmdb_env.begin(write=True) as txn:
-                entries = lmdb_env.stat()["entries"]
-                txn.put(entries.to_bytes(length=4, byteorder='big'), data_dict)
+        # all frames of this idx go in one transaction, so the entry count is read once
+        with lmdb_env.begin(write=True) as txn:
+            entries = lmdb_env.stat()["entries"]
+            for nf in range(n_frames):
+                data_dict = {}
+                data_dict[_keys.ATOMIC_NUMBERS_KEY] = structure[_keys.ATOMIC_NUMBERS_KEY]
+                data_dict[_keys.CELL_KEY] = structure[_keys.CELL_KEY][nf]
+                data_dict[_keys.POSITIONS_KEY] = structure[_keys.POSITIONS_KEY][nf]
+                data_dict[_keys.PBC_KEY] = structure[_keys.PBC_KEY]
+
+                if eigenvalue:
+                    data_dict[_keys.ENERGY_EIGENVALUE_KEY] = eigstatus[_keys.ENERGY_EIGENVALUE_KEY][nf]
+                    data_dict[_keys.KPOINT_KEY] = eigstatus[_keys.KPOINT_KEY]
+
+                if hamiltonian:
+                    data_dict["hamiltonian"] = ham[nf]
+                if overlap:
+                    data_dict["overlap"] = ovp[nf]
+                if density_matrix:
+                    data_dict["density_matrix"] = dm[nf]
+
+                data_dict["idx"] = idx
+                data_dict["nf"] = nf
+
+                data_dict = pickle.dumps(data_dict, protocol=pickle.HIGHEST_PROTOCOL)
+
+                # write
+                txn.put((entries + nf).to_bytes(length=4, byteorder='big'), data_dict)
 
         lmdb_env.close()
@@ -1,5 +1,4 @@
 from scipy.linalg import block_diag
-import re
 from tqdm import tqdm
 from collections import Counter
 from dftio.constants import orbitalId
@@ -24,12 +23,20 @@ class VASPParser(Parser):
             ):
         super(VASPParser, self).__init__(root, prefix)
 
-        self.raw_sys = [read(self.raw_datas[idx]+'/POSCAR') for idx in range(len(self.raw_datas))]
+        # POSCARs are read lazily on first access and cached by idx
+        self.raw_sys = {}
         log.warning("VASP parser only supports the static (SCF or NSCF) calculations. MD and RELAX is not supported yet.")
     
+    def _get_raw(self, idx):
+        sys = self.raw_sys.get(idx)
+        if sys is None:
+            sys = read(self.raw_datas[idx]+'/POSCAR')
+            self.raw_sys[idx] = sys
+        return sys
+
     # essential
     def get_structure(self, idx):
-        sys = self.raw_sys[idx]
+        sys = self._get_raw(idx)
         
         structure = self.ase_to_structure(sys)
 
@@ -48,29 +55,18 @@ class VASPParser(Parser):
     def read_EIGENVAL(file):
         Nhse = 0 # number of HSE bands, used for HSE, 
         with open(file, 'r') as f: 
-            data = f.readlines()
-        # Read the number of bands
-        NBND = int(re.findall('[0-9]+', data[5])[2])
-        k_list = []
-        k_bands = []
-        kb_temp = []
-        kb_count = 0
-        for i in range(7+(NBND+2)*Nhse, len(data)):
-            temp = re.findall('[0-9\-\.\+E]+', data[i])
-            if not temp:
-                continue
-            if len(temp) == 4:
-                kt = (np.array([float(i) for i in temp[0:3]])).tolist()
-                k_list.append(kt)
-            else:
-                kb_temp.append(float(temp[1])) # the energy.
-                kb_count += 1
-                if kb_count == NBND:
-                    k_bands.append(sorted(kb_temp))
-                    kb_temp = []
-                    kb_count = 0
-        k_bands = np.array(k_bands)[np.newaxis, :, :] # [1, nk, nbands]
-        k_list = np.asarray(k_list) # [nk, 3] 
+            header = [f.readline() for _ in range(7)]
+            body = f.read()
+        # Read the number of kpoints and bands
+        _, nk, NBND = (int(i) for i in header[5].split()[:3])
+        # The body repeats [kx ky kz weight] followed by NBND lines of [index energy occ ...],
+        # so it can be parsed in one shot and reshaped into one row per k-point.
+        values = np.fromstring(body, sep=' ').reshape(nk, -1)
+        ncol = (values.shape[1] - 4) // NBND
+        values = values[Nhse:]
+        k_list = values[:, :3] # [nk, 3]
+        k_bands = np.sort(values[:, 4:].reshape(-1, NBND, ncol)[:, :, 1], axis=-1)
+        k_bands = k_bands[np.newaxis, :, :] # [1, nk, nbands]
 
         return k_list, k_bands
 
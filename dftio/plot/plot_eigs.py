@@ -15,9 +15,12 @@ class BandPlot(object):
     def load_dat(self, fmt=None):
         # load structure
         assert os.path.exists(self.path), f"Path {self.path} does not exist!"
+        if fmt is not None and fmt not in ('dat', 'npy', 'ase'):
+            raise ValueError(f"Unknown format {fmt}, should be one of dat, npy or ase!")
         # 判断文件格式       
         fmt_1 = False
         fmt_2 = False
+        fmt_3 = False
         if os.path.exists(os.path.join(self.path, "cell.dat")) \
                 and os.path.exists(os.path.join(self.path, "positions.dat")) \
                 and os.path.exists(os.path.join(self.path, "atomic_numbers.dat")) \
@@ -28,14 +31,22 @@ class BandPlot(object):
         if os.path.exists(os.path.join(self.path, "xdat.traj")):
             fmt_2 = True
 
-        if fmt_1 and fmt_2:
+        if os.path.exists(os.path.join(self.path, "cell.npy")) \
+                and os.path.exists(os.path.join(self.path, "positions.npy")) \
+                and os.path.exists(os.path.join(self.path, "atomic_numbers.npy")) \
+                and os.path.exists(os.path.join(self.path, "pbc.npy")):
+            log.info(".npy file exists, Loading data from npy format!")
+            fmt_3 = True
+
+        if sum([fmt_1, fmt_2, fmt_3]) > 1:
             if fmt is None:
-                raise ValueError("Both .dat and .traj files exist, please specify the format!")
+                raise ValueError("More than one of .dat, .npy and .traj files exist, please specify the format!")
             else:
-                log.warning(f"Both .dat and .traj files exist, using user defined fmt {fmt}!")
+                log.warning(f"More than one of .dat, .npy and .traj files exist, using user defined fmt {fmt}!")
+                fmt_1, fmt_2, fmt_3 = fmt == 'dat', fmt == 'ase', fmt == 'npy'
 
         
-        if fmt_1 and not fmt_2:
+        if fmt_1:
             self.cell = np.loadtxt(os.path.join(self.path, "cell.dat")).reshape(-1, 3)
             self.positions = np.loadtxt(os.path.join(self.path, "positions.dat")).reshape(-1, 3)
             self.atomic_numbers = np.loadtxt(os.path.join(self.path, "atomic_numbers.dat"), dtype=np.int32)
@@ -44,7 +55,16 @@ class BandPlot(object):
             if not(fmt is None or fmt == 'dat'):
                 log.warning(f"detect the .dat format, and user defiend {fmt}, using dat format instead!")
         
-        if fmt_2 and not fmt_1:
+        if fmt_3:
+            self.cell = np.load(os.path.join(self.path, "cell.npy")).reshape(-1, 3)
+            self.positions = np.load(os.path.join(self.path, "positions.npy")).reshape(-1, 3)
+            self.atomic_numbers = np.load(os.path.join(self.path, "atomic_numbers.npy"))
+            self.pbc = np.load(os.path.join(self.path, "pbc.npy"))
+
+            if not(fmt is None or fmt == 'npy'):
+                log.warning(f"detect the .npy format, and user defiend {fmt}, using npy format instead!")
+
+        if fmt_2:
             trajfile = Trajectory(os.path.join(self.path, "xdat.traj"), 'r')
             self.cell = trajfile[0].cell
             self.positions = trajfile[0].positions
@@ -54,8 +74,8 @@ class BandPlot(object):
             if not(fmt is None or fmt == 'ase'):
                 log.warning(f"detect the .traj format, and user defiend {fmt}, using ase format instead!")
 
-        if not fmt_1 and not fmt_2:
-            raise ValueError("No .dat or .traj files exist, please check the path!")
+        if not any([fmt_1, fmt_2, fmt_3]):
+            raise ValueError("No .dat, .npy or .traj files exist, please check the path!")
 
         self.kpoints = np.load(os.path.join(self.path, "kpoints.npy"))
         self.eigs = np.load(os.path.join(self.path, "eigenvalues.npy"))
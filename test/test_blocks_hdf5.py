@@ -0,0 +1,30 @@
+import h5py
+import numpy as np
+from dftio.io.parse import write_blocks_hdf5, read_blocks_hdf5
+
+
+def test_blocks_hdf5_roundtrip(tmp_path):
+    blocks = [
+        {
+            "0_0_0_0_0": np.arange(4, dtype=np.float32).reshape(2, 2),
+            "0_1_-1_0_2": np.arange(6, dtype=np.float32).reshape(2, 3),
+            "1_0_1_0_-2": np.arange(6, dtype=np.float32).reshape(3, 2) - 3.5,
+        },
+        {
+            "1_1_0_-1_0": (np.arange(9) + 1j * np.arange(9)).astype(np.complex64).reshape(3, 3),
+        },
+        {},
+    ]
+
+    with h5py.File(tmp_path / "blocks.h5", "w") as fid:
+        for i, frame in enumerate(blocks):
+            write_blocks_hdf5(fid.create_group(str(i)), frame)
+
+    with h5py.File(tmp_path / "blocks.h5", "r") as fid:
+        for i, frame in enumerate(blocks):
+            read = read_blocks_hdf5(fid[str(i)])
+            assert list(read.keys()) == list(frame.keys())
+            for key, value in frame.items():
+                assert read[key].shape == value.shape
+                assert read[key].dtype == value.dtype
+                assert np.array_equal(read[key], value)